@@ -1,12 +1,64 @@
 
 from mcts_node import MCTSNode
 from p2_t3 import Board
+from p2_t3_bits import BitBoard, random_legal
+try:
+    from p2_t3_c import CBoard as BitBoard     # compiled rules, when p2_t3_c.pyx has been built
+except ImportError:
+    pass
 from random import choice
 import random
-from math import sqrt, log
+import multiprocessing
+import os
+import threading
+import time
+from math import sqrt, log, inf, ceil
 
 num_nodes = 750
+rollouts_per_leaf = 8                   # Simulations run from every expanded node before backpropagating
+num_workers = os.cpu_count() or 1      # Processes that each build an independent tree
+num_threads = 1                         # Threads sharing each tree; only pays off when rollouts run without the GIL
+virtual_loss = 1                        # Pending visits counted as losses on a path while a thread simulates it
 explore_faction = 2.
+VERBOSE = False                         # Print the chosen action after every think
+widening_c = 1.5                        # A node with v visits may have up to ceil(widening_c * v ** widening_alpha) children
+widening_alpha = 0.5
+bit_board = BitBoard()                  # Rules used for rollouts, on compact bitboard states
+
+# Zobrist keys: one per square and player, plus one per constraint on the next sub-board (9 means unconstrained)
+_zobrist_random = random.Random(0)
+ZOBRIST = [[_zobrist_random.getrandbits(64) for player in range(2)] for square in range(81)]
+ZOBRIST_ACTIVE = [_zobrist_random.getrandbits(64) for board in range(10)]
+
+transpositions = {1: {}, 2: {}}         # Bot identity -> Zobrist hash -> MCTSNode, kept for the whole game
+_root_pieces = {1: 0, 2: 0}             # Bot identity -> pieces on the board at the last think, to detect new games
+_pool = None                            # Worker processes, kept alive so their transposition tables survive between moves
+_pool_size = 0
+# Settings sent along with every batch, since the persistent workers would otherwise keep the values they were forked with
+_WORKER_SETTINGS = ("rollouts_per_leaf", "num_threads", "virtual_loss", "explore_faction", "widening_c", "widening_alpha")
+
+def new_node(parent: MCTSNode|None, parent_action, actions: list, key: int|None):
+    """ Creates a node with the per-child statistic arrays this bot selects from. They replace the node's
+    untried_actions list, which stays None.
+
+    Args:
+        parent:         The parent node of the new node.
+        parent_action:  The action taken from the parent node that transitions the state to the new node.
+        actions:        The legal actions of the new node, in the order they will be expanded.
+        key:            Zobrist hash of the new node's state.
+
+    Returns:    The new node
+
+    """
+    node = MCTSNode(parent=parent, parent_action=parent_action, action_list=None)
+    node.child_actions = tuple(actions)     # Every legal action; the first expanded_count of them have a child
+    node.child_wins = [0] * len(actions)    # Wins of each child, parallel to child_actions
+    node.child_visits = [0] * len(actions)  # Visits of each child, parallel to child_actions
+    node.child_vloss = [0] * len(actions)   # Pending virtual losses of each child, parallel to child_actions
+    node.expanded_count = 0                 # Number of children created so far
+    node.key = key                          # Zobrist hash of the node's state, for transposition lookups
+    node.vloss = 0                          # Pending virtual losses of the searches passing through this node
+    return node
 
 def traverse_nodes(node: MCTSNode, board: Board, state, bot_identity: int):
     """ Traverses the tree until the end criterion are met.
@@ -20,76 +72,150 @@ def traverse_nodes(node: MCTSNode, board: Board, state, bot_identity: int):
         identity:   The bot's identity, either 1 or 2
 
     Returns:
-        node: A node from which the next stage of the search can proceed.
+        path: The (parent, index, child) edges taken, starting with (None, None, node); the last child
+              is the node from which the next stage of the search can proceed.
         state: The state associated with that node
 
     """
-    while len(node.child_nodes) > 0 and len(node.untried_actions) == 0 and board.is_ended(state) == False:
+    path = [(None, None, node)]
+    # terminal nodes have no actions, so the loop stops at them without checking the state
+    while node.expanded_count > 0 and node.expanded_count >= allowed_children(node):
         # finds out if last action was committed by opponent
         is_opponent = True
         if board.current_player(state) == bot_identity:
             is_opponent = False
         
-        child_nodes_values = node.child_nodes.values()
-        best_node = None
-        best_ucb_value = float('-inf')  # Initialize to negative infinity
+        index = best_child(node.child_wins, node.child_visits, node.child_vloss, node.expanded_count,
+                           node.visits + node.vloss, is_opponent, explore_faction)
+        action = node.child_actions[index]
+        child = node.child_nodes[action]
+        path.append((node, index, child))
+        node = child
 
-        for child_node in child_nodes_values:
-            current_ucb_value = ucb(child_node, is_opponent)
-            if current_ucb_value >= best_ucb_value:
-                best_node = child_node
-                best_ucb_value = current_ucb_value
+        state = board.next_state(state, action)
+    return path, state
 
-        node = best_node
+def allowed_children(node: MCTSNode):
+    """ Progressive widening: the number of children a node may have, growing with the square root of its visits.
 
-        state = board.next_state(state, node.parent_action)
-    return node, state
+    Args:
+        node:   A node.
+    Returns:
+        The number of children that may be expanded at the node
+    """
+    return min(len(node.child_actions), max(1, ceil(widening_c * node.visits ** widening_alpha)))
 
-def expand_leaf(node: MCTSNode, board: Board, state):
-    """ Adds a new leaf to the tree by creating a new child node for the given node (if it is non-terminal).
+def expand_leaf(path: list, board: Board, state, table: dict|None = None):
+    """ Adds a new leaf to the tree by creating a new child node for the given node (if it is non-terminal
+    and allowed more children).
+    If the resulting position is already in the transposition table, that node is linked instead.
 
     Args:
-        node:   The node for which a child will be added.
+        path:   The edges from traverse_nodes; the last child is the node for which a child will be added.
         board:  The game setup.
         state:  The state of the game.
+        table:  Optional Zobrist hash -> MCTSNode transposition table.
 
     Returns:
-        node: The added child node
+        path: The path with the edge to the added child node appended
         state: The state associated with that node
 
     """
-    if len(node.untried_actions) > 0:
-        action = node.untried_actions.pop(0)
-        state = board.next_state(state, action) 
-        n = MCTSNode(parent=node,parent_action=action, action_list=board.legal_actions(state))
+    node = path[-1][2]
+    if node.expanded_count < allowed_children(node):
+        index = node.expanded_count
+        action = node.child_actions[index]
+        next_state = board.next_state(state, action)
+        key = None
+        n = None
+        if table is not None:
+            key = child_key(node.key, state, action, next_state)
+            n = table.get(key)
+        if n is None:
+            # legal actions are computed once per node; an ended game has none. They are shuffled so
+            # progressive widening does not always favour the same squares.
+            actions = [] if board.is_ended(next_state) else board.legal_actions(next_state)
+            random.shuffle(actions)
+            n = new_node(node, action, actions, key)
+            if table is not None:
+                table[key] = n
+        state = next_state
         node.child_nodes[action] = n
+        node.expanded_count += 1
+        path.append((node, index, n))
     
-    return node, state
+    return path, state
+
+def _active(state):
+    # index of the sub-board the next action is constrained to, 9 if unconstrained
+    return 9 if state[20] is None else 3 * state[20] + state[21]
+
+def zobrist_hash(state):
+    """ Computes the Zobrist hash of a p2_t3 state from scratch.
+
+    Args:
+        state:  The state of the game.
+
+    Returns:    The 64-bit hash of the state
+
+    """
+    h = ZOBRIST_ACTIVE[_active(state)]
+    for b in range(9):
+        for player in range(2):
+            pieces = state[2 * b + player]
+            for k in range(9):
+                if pieces & (1 << k):
+                    h ^= ZOBRIST[9 * b + k][player]
+    return h
+
+def child_key(key: int, state, action, next_state):
+    """ Updates a Zobrist hash for the given action.
+
+    Args:
+        key:        The hash of state.
+        state:      The state the action is played in.
+        action:     The (R, C, r, c) action.
+        next_state: The state after the action.
+
+    Returns:    The hash of next_state
+
+    """
+    R, C, r, c = action
+    return key ^ ZOBRIST[9 * (3 * R + C) + 3 * r + c][state[-1] - 1] ^ ZOBRIST_ACTIVE[_active(state)] ^ ZOBRIST_ACTIVE[_active(next_state)]
 
 # rollout (board, state)
 # simulate the remainder of the game by making random moves until the game is over
-def testaction(board, state, action, depth, bot_identity):
-    test_state = board.next_state(state, action)
+def testaction(board, test_state, bot_identity, max_depth=20):
+    """ Scores an action by playing random moves after it until the game ends or max_depth moves were played.
 
-    if board.is_ended(test_state) or depth > 19:
-        if board.is_ended(test_state) and is_win(board,test_state,bot_identity):
-            return depth * -1
-        else:
-            return depth
+    Args:
+        board:          The bitboard game setup.
+        test_state:     The bitboard state reached by the action to score.
+        bot_identity:   The bot's identity, either 1 or 2
+        max_depth:      The number of random moves after which the playout is cut off.
 
-    selected_action = choice(board.legal_actions(test_state))
+    Returns:
+        The number of random moves played, negated if the bot won; lower is better
 
-    return testaction(board, test_state, selected_action, depth + 1, bot_identity)
+    """
+    depth = 0
+    while not board.is_ended(test_state) and depth < max_depth:
+        test_state = board.next_state(test_state, random_legal(board.legal_bits(test_state)))
+        depth += 1
+
+    if board.is_ended(test_state) and is_win(board, test_state, bot_identity):
+        return depth * -1
+    return depth
 
-def rollout(board: Board, state, bot_identity: int):
+def rollout(board: BitBoard, state, bot_identity: int):
     """ Modified rollout function using improved_rollout with additional parameters.
 
     Args:
-        board:  The game setup.
-        state:  The state of the game.
+        board:  The bitboard game setup.
+        state:  The bitboard state of the game.
 
     Returns:
-        state: The terminal game state.
+        state: The terminal bitboard state.
 
     """
 
@@ -102,83 +228,108 @@ def rollout(board: Board, state, bot_identity: int):
         if len(actions) == 0:
             break
         
-        for action in actions:
-            next_state = board.next_state(state,action)
+        # the successor states are needed for the end check, so reuse them for the move itself
+        next_states = [board.next_state(state, action) for action in actions]
+        for next_state in next_states:
             if board.is_ended(next_state):
                 return next_state  
 
         if random.random() < exploration_factor:
-            selected_action = choice(actions)
-            state = board.next_state(state, selected_action)
+            state = choice(next_states)
         else:
-            selected_action = min(actions, key=lambda n: testaction(board, state, n, 0, bot_identity))
-            state = board.next_state(state, selected_action)
-        
-        # continue the loop until the game is ended
-        randomAction = choice(board.legal_actions(state))   # randomly select a move from legal moves
-        state = board.next_state(state, randomAction)       # update the state accordingly
+            state = min(next_states, key=lambda n: testaction(board, n, bot_identity))
 
     # Return the terminal game state after the loop
     return state
 
 
-# backpropagate(node, won)
-# uses recursion to traverse from the leaf node to the root
+# backpropagate(path, wins_delta, visits_delta)
+# walks the path recorded during selection
 # it updates the statistics of each node on the way
-def backpropagate(node: MCTSNode|None, won: bool):
-    """ Navigates the tree from a leaf node to the root, updating the win and visit count of each node along the path.
+def backpropagate(path: list, wins_delta: int, visits_delta: int):
+    """ Updates the win and visit count of each node along the path, and of the edges leading to them.
 
     Args:
-        node:   A leaf node.
-        won:    An indicator of whether the bot won or lost the game.
+        path:           The (parent, index, child) edges from the root to a leaf node.
+        wins_delta:     The number of simulated games the bot won.
+        visits_delta:   The number of simulated games.
 
     """
-    if won == True:
-        node.wins += 1                  # if the base case is false, update the wins
-    node.visits += 1                    # and visits of the current node based on the outcome of the game
-
-    if(node.parent is None):            # check if the current node has no parent
-        return                          # if leaf node is reached, terminate the recursion
-
-    backpropagate(node.parent, won)     # recursively call backpropagate() with the parent of the current node and the same won value
-
-def ucb(node: MCTSNode, is_opponent: bool):
-    """ Calcualtes the UCB value for the given node from the perspective of the bot
+    for parent, index, child in path:
+        child.wins += wins_delta
+        child.visits += visits_delta
+        if parent is not None:          # mirror the statistics into the parent's child arrays
+            parent.child_wins[index] += wins_delta
+            parent.child_visits[index] += visits_delta
+
+def add_virtual_loss(path: list):
+    """ Marks every edge in the path as being simulated, so other threads prefer different paths. """
+    for parent, index, child in path:
+        if parent is not None:
+            parent.child_vloss[index] += virtual_loss
+        child.vloss += virtual_loss
+
+def remove_virtual_loss(path: list):
+    """ Undoes add_virtual_loss for every edge in the path. """
+    for parent, index, child in path:
+        if parent is not None:
+            parent.child_vloss[index] -= virtual_loss
+        child.vloss -= virtual_loss
+
+def best_child(wins, visits, vloss, count: int, parent_visits: int, is_opponent: bool, c: float):
+    """ Picks the child with the highest UCB value from the perspective of the bot.
+    Virtual losses count as extra visits lost by the player choosing the child.
 
     Args:
-        node:   A node.
-        is_opponent: A boolean indicating whether or not the last action was performed by the MCTS bot
+        wins:           The win counts of the children, parallel to visits.
+        visits:         The visit counts of the children.
+        vloss:          The pending virtual losses of the children.
+        count:          The number of children to consider, from the start of the arrays.
+        parent_visits:  The visit count of the node the children belong to, including its virtual losses.
+        is_opponent:    A boolean indicating whether or not the last action was performed by the MCTS bot
+        c:              The exploration factor.
     Returns:
-        The value of the UCB function for the given node
+        The index of the best child; unvisited children are returned immediately
     """
     # ucb formula is (child node wins / child node total visits) + (exploration factor)*(sqrt(ln(current node total visits)/child node total visits))
-    if node.visits == 0:
-        return float("inf")
-    
-    first_half = node.wins / node.visits
-    v = log(node.parent.visits)
-    second_half = explore_faction * sqrt(v / node.visits) 
-    ucb_value = first_half + second_half
-
-    if is_opponent == True:
-        return 1 - ucb_value
+    # c * sqrt(ln(parent visits) / v) == k / sqrt(v), so the parent's part is computed once per scan
+    k = c * sqrt(log(parent_visits))
+    best_index = -1
+    best_ucb_value = -inf
+    if is_opponent:
+        for i in range(count):
+            v = visits[i] + vloss[i]
+            if v == 0:
+                return i
+            ucb_value = 1 - (wins[i] + vloss[i]) / v - k / sqrt(v)
+            if ucb_value > best_ucb_value:
+                best_ucb_value = ucb_value
+                best_index = i
     else:
-        return ucb_value
-
-def get_best_action(root_node: MCTSNode):
-    """ Selects the best action from the root node in the MCTS tree
+        for i in range(count):
+            v = visits[i] + vloss[i]
+            if v == 0:
+                return i
+            ucb_value = wins[i] / v + k / sqrt(v)
+            if ucb_value > best_ucb_value:
+                best_ucb_value = ucb_value
+                best_index = i
+    return best_index
+
+def get_best_action(action_stats: dict):
+    """ Selects the best action from the statistics gathered for the root node in the MCTS tree
 
     Args:
-        root_node:   The root node
+        action_stats:   Action -> (wins, visits) dictionary of the root's children
     Returns:
-        action: The best action from the root node
+        action: The action with the best win rate
     
     """
     best_action = None
     best_win_rate = -1
-    for key, child_node in root_node.child_nodes.items():
-        if child_node.visits > 0:
-            win_rate = child_node.wins/ child_node.visits
+    for key, (wins, visits) in action_stats.items():
+        if visits > 0:
+            win_rate = wins / visits
             if win_rate > best_win_rate:
                 best_action = key
                 best_win_rate = win_rate
@@ -190,8 +341,121 @@ def is_win(board: Board, state, identity_of_bot: int):
     assert outcome is not None, "is_win was called on a non-terminal state"
     return outcome[identity_of_bot] == 1
 
+def _run_batch(board: Board, current_state, bot_identity: int, n: int):
+    """ Builds a tree from the current state by sampling n games, rollouts_per_leaf at a time, on num_threads threads.
+
+    Args:
+        board:          The game setup.
+        current_state:  The current state of the game.
+        bot_identity:   The bot's identity, either 1 or 2
+        n:              The number of games to sample.
+
+    Returns:    Action -> (wins, visits) dictionary of the root's children, counting only the games sampled
+                in this call; a root reused from earlier moves keeps its older statistics in the tree
+
+    """
+    # reuse the subtree searched on previous moves, starting over when a new game begins
+    table = transpositions[bot_identity]
+    pieces = sum(bin(p).count("1") for p in current_state[:18])
+    if pieces < _root_pieces[bot_identity]:
+        table.clear()
+    _root_pieces[bot_identity] = pieces
+
+    key = zobrist_hash(current_state)
+    root_node = table.get(key)
+    if root_node is None:
+        actions = board.legal_actions(current_state)
+        random.shuffle(actions)
+        root_node = new_node(None, None, actions, key)
+        table[key] = root_node
+
+    wins_before = list(root_node.child_wins)
+    visits_before = list(root_node.child_visits)
+
+    lock = threading.Lock()
+    budget = [n]
+    if num_threads > 1:
+        threads = [threading.Thread(target=_search, args=(root_node, board, current_state, bot_identity, table, budget, lock))
+                   for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        _search(root_node, board, current_state, bot_identity, table, budget, lock)
+
+    return {action: (root_node.child_wins[i] - wins_before[i], root_node.child_visits[i] - visits_before[i])
+            for i, action in enumerate(root_node.child_actions)}
+
+def _search(root_node: MCTSNode, board: Board, current_state, bot_identity: int, table: dict, budget: list, lock):
+    """ Samples games into a tree until the shared budget is used up. Several threads can search the same tree:
+    selection, expansion and backpropagation happen under the lock, the rollouts outside of it.
+
+    Args:
+        root_node:      The root node
+        board:          The game setup.
+        current_state:  The state of the root node.
+        bot_identity:   The bot's identity, either 1 or 2
+        table:          Zobrist hash -> MCTSNode transposition table.
+        budget:         One-element list holding the number of games left to sample.
+        lock:           The lock guarding the tree.
+
+    """
+    threaded = num_threads > 1
+    while True:
+        with lock:
+            if budget[0] <= 0:
+                return
+            k = min(rollouts_per_leaf, budget[0])
+            budget[0] -= k
+
+            # traverse node to find best option
+            path, state = traverse_nodes(root_node, board, current_state, bot_identity)
+
+            # add node to tree
+            path, state = expand_leaf(path, board, state, table)
+            if threaded:
+                add_virtual_loss(path)
+
+        # do several simulations with the added node, switching to the bitboard representation
+        start = bit_board.from_state(state)
+        w = 0
+        for _ in range(k):
+            state = rollout(bit_board, start, bot_identity)
+
+            # find out if player/bot won or not
+            if is_win(bit_board, state, bot_identity):
+                w += 1
+
+        with lock:
+            if threaded:
+                remove_virtual_loss(path)
+
+            # add information from the simulations back into board
+            backpropagate(path, w, k)
+
+def _worker_think(args):
+    """ Entry point of the worker processes; applies the caller's settings and reseeds the random generator
+    so each worker samples different games. """
+    *batch, settings = args
+    globals().update(settings)
+    random.seed(os.getpid() ^ time.time_ns())
+    return _run_batch(*batch)
+
+def _get_pool(workers: int):
+    """ Returns the pool of worker processes, (re)starting it if the number of workers changed. """
+    global _pool, _pool_size
+    if _pool is None or _pool_size != workers:
+        if _pool is not None:
+            _pool.terminate()
+        _pool = multiprocessing.get_context("fork").Pool(workers)
+        _pool_size = workers
+    return _pool
+
 def think(board: Board, current_state):
     """ Performs MCTS by sampling games and calling the appropriate functions to construct the game tree.
+    The games are split over num_workers processes, each building its own tree, and the statistics
+    of the root's children are summed afterwards.
 
     Args:
         board:  The game setup.
@@ -201,30 +465,25 @@ def think(board: Board, current_state):
 
     """
     bot_identity = board.current_player(current_state) # 1 or 2
-    root_node = MCTSNode(parent=None, parent_action=None, action_list=board.legal_actions(current_state))
-
-    for _ in range(num_nodes):
-        state = current_state
-        node = root_node
 
-        # Do MCTS - This is all you!
-        # ...
-        # traverse node to find best option
-        leaf_node, state = traverse_nodes(node, board, state, bot_identity)
+    workers = num_workers if "fork" in multiprocessing.get_all_start_methods() else 1
+    if workers > 1:
+        settings = {name: globals()[name] for name in _WORKER_SETTINGS}
+        batches = [(board, current_state, bot_identity, num_nodes // workers + (i < num_nodes % workers), settings)
+                   for i in range(workers)]
+        results = _get_pool(workers).map(_worker_think, batches)
+    else:
+        results = [_run_batch(board, current_state, bot_identity, num_nodes)]
 
-        # add node to tree
-        expand_node, state = expand_leaf(leaf_node, board, state)
-        
-        # do simulation with the added node
-        state = rollout(board, state, bot_identity)
-        
-        # find out if player/bot won or not
-        w = is_win(board, state, bot_identity)
+    action_stats = {}
+    for result in results:
+        for action, (wins, visits) in result.items():
+            total_wins, total_visits = action_stats.get(action, (0, 0))
+            action_stats[action] = (total_wins + wins, total_visits + visits)
 
-        # add information from simulation back into board
-        backpropagate(expand_node, w)
     # Return an action, typically the most frequently used action (from the root) or the action with the best
     # estimated win rate.
-    best_action = get_best_action(root_node)
-    print(f"Action chosen: {best_action}")
+    best_action = get_best_action(action_stats)
+    if VERBOSE:
+        print(f"Action chosen: {best_action}")
     return best_action
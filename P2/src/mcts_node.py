@@ -1,6 +1,12 @@
 
 
 class MCTSNode:
+    # Fixed attributes instead of a per-instance __dict__: smaller nodes and faster attribute access.
+    # child_actions through vloss are only set on the nodes mcts_modified creates, see mcts_modified.new_node.
+    __slots__ = ('parent', 'parent_action', 'child_nodes', 'untried_actions',
+                 'child_actions', 'child_wins', 'child_visits', 'child_vloss', 'expanded_count', 'key',
+                 'wins', 'visits', 'vloss')
+
     def __init__(self, parent=None, parent_action=None, action_list=[]):
         """ Initializes the tree node for MCTS. The node stores links to other nodes in the tree (parent and child
         nodes), as well as keeps track of the number of wins and total simulations that have visited the node.
@@ -1,10 +1,11 @@
 from mcts_node import MCTSNode
 from p2_t3 import Board
 from random import choice
-from math import sqrt, log
+from math import sqrt, log, inf
 
 num_nodes = 750
 explore_faction = 2.
+VERBOSE = False                         # Print the chosen action after every think
 
 def traverse_nodes(node: MCTSNode, board: Board, state, bot_identity: int):
     """ Traverses the tree until the end criterion are met.
@@ -15,30 +16,23 @@ def traverse_nodes(node: MCTSNode, board: Board, state, bot_identity: int):
         node:       A tree node from which the search is traversing.
         board:      The game setup.
         state:      The state of the game.
-        identity:   The bot's identity, either 1 or 2
+        bot_identity:   The bot's identity, either 1 or 2
 
     Returns:
         node: A node from which the next stage of the search can proceed.
         state: The state associated with that node
 
     """
+    _ucb = ucb
     while len(node.child_nodes) > 0 and len(node.untried_actions) == 0 and board.is_ended(state) == False:
         # finds out if last action was committed by opponent
-        is_opponent = True
-        if board.current_player(state) == bot_identity:
-            is_opponent = False
-        
-        child_nodes_values = node.child_nodes.values()
-        best_node = None
-        best_ucb_value = float('-inf')  # Initialize to negative infinity
+        is_opponent = board.current_player(state) != bot_identity
 
-        for child_node in child_nodes_values:
-            current_ucb_value = ucb(child_node, is_opponent)
-            if current_ucb_value >= best_ucb_value:
-                best_node = child_node
-                best_ucb_value = current_ucb_value
+        # the parent's visit count is the same for every child, so take its log once
+        log_parent_visits = log(node.visits)
 
-        node = best_node
+        # let the max builtin scan the children instead of a Python loop
+        node = max(node.child_nodes.values(), key=lambda child_node: _ucb(child_node, log_parent_visits, is_opponent))
 
         state = board.next_state(state, node.parent_action)
     return node, state
@@ -61,6 +55,7 @@ def expand_leaf(node: MCTSNode, board: Board, state):
         state = board.next_state(state, action) 
         n = MCTSNode(parent=node,parent_action=action, action_list=board.legal_actions(state))
         node.child_nodes[action] = n
+        node = n
     
     return node, state
 
@@ -85,7 +80,7 @@ def rollout(board: Board, state):
     return state                                            # return the final state after the rollout
 
 # backpropagate(node, won)
-# uses recursion to traverse from the leaf node to the root
+# walks from the leaf node up to the root
 # it updates the statistics of each node on the way
 def backpropagate(node: MCTSNode|None, won: bool):
     """ Navigates the tree from a leaf node to the root, updating the win and visit count of each node along the path.
@@ -95,38 +90,45 @@ def backpropagate(node: MCTSNode|None, won: bool):
         won:    An indicator of whether the bot won or lost the game.
 
     """
-    if won == True:
-        node.wins += 1                  # if the base case is false, update the wins
-    node.visits += 1                    # and visits of the current node based on the outcome of the game
-
-    if(node.parent is None):            # check if the current node has no parent
-        return                          # if leaf node is reached, terminate the recursion
-
-    backpropagate(node.parent, won)     # recursively call backpropagate() with the parent of the current node and the same won value
+    while node is not None:
+        node.visits += 1
+        if won:
+            node.wins += 1
+        node = node.parent
 
-def ucb(node: MCTSNode, is_opponent: bool):
-    """ Calcualtes the UCB value for the given node from the perspective of the bot
+def make_ucb(c: float):
+    """ Builds the UCB function for a fixed exploration factor. The factor and the math functions are bound
+    inside the returned function, so a call does no global lookups.
 
     Args:
-        node:   A node.
-        is_opponent: A boolean indicating whether or not the last action was performed by the MCTS bot
+        c:      The exploration factor.
     Returns:
-        The value of the UCB function for the given node
+        The ucb function, see below
     """
-    # ucb formula is (child node wins / child node total visits) + (exploration factor)*(sqrt(ln(current node total visits)/child node total visits))
-    if node.visits == 0:
-        return float("inf")
-    
-    first_half = node.wins / node.visits
-    v = log(node.parent.visits)
-    second_half = explore_faction * sqrt(v / node.visits) 
-    ucb_value = first_half + second_half
-
-    if is_opponent == True:
-        return 1 - ucb_value
-    else:
+    def ucb(node: MCTSNode, log_parent_visits: float, is_opponent: bool, _sqrt=sqrt, _inf=inf):
+        """ Calcualtes the UCB value for the given node from the perspective of the bot
+
+        Args:
+            node:   A node.
+            log_parent_visits: The natural log of the parent's visit count, shared by all of its children
+            is_opponent: A boolean indicating whether or not the last action was performed by the MCTS bot
+        Returns:
+            The value of the UCB function for the given node
+        """
+        # ucb formula is (child node wins / child node total visits) + (exploration factor)*(sqrt(ln(current node total visits)/child node total visits))
+        visits = node.visits
+        if visits == 0:
+            return _inf
+
+        ucb_value = node.wins / visits + c * _sqrt(log_parent_visits / visits)
+        if is_opponent:
+            return 1 - ucb_value
         return ucb_value
 
+    return ucb
+
+ucb = make_ucb(explore_faction)         # Rebuild with make_ucb after changing explore_faction
+
 def get_best_action(root_node: MCTSNode):
     """ Selects the best action from the root node in the MCTS tree
 
@@ -188,5 +190,6 @@ def think(board: Board, current_state):
     # Return an action, typically the most frequently used action (from the root) or the action with the best
     # estimated win rate.
     best_action = get_best_action(root_node)
-    print(f"Action chosen: {best_action}")
+    if VERBOSE:
+        print(f"Action chosen: {best_action}")
     return best_action
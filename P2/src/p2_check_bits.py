@@ -0,0 +1,53 @@
+""" Plays random games on p2_t3.Board and checks that the rollout boards and the Zobrist hashes of
+mcts_modified agree with it after every action.
+
+Usage: python p2_check_bits.py [games]
+"""
+
+import sys
+import random
+import p2_t3
+import p2_t3_bits
+from mcts_modified import zobrist_hash, child_key
+
+board = p2_t3.Board()
+rollout_boards = dict(BitBoard=p2_t3_bits.BitBoard())
+try:
+    import p2_t3_c
+    rollout_boards['CBoard'] = p2_t3_c.CBoard()
+except ImportError:
+    print("p2_t3_c is not built, only checking BitBoard")
+
+games = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def square(action):
+    # square index of a p2_t3 (R, C, r, c) action
+    R, C, r, c = action
+    return 9 * (3 * R + C) + 3 * r + c
+
+
+for name, bits in rollout_boards.items():
+    for i in range(games):
+        state = board.starting_state()
+        bit_state = bits.from_state(state)
+        key = zobrist_hash(state)
+        while True:
+            assert bits.from_state(state) == bit_state, (name, state, bit_state)
+            assert key == zobrist_hash(state), (name, state)
+            assert bits.current_player(bit_state) == board.current_player(state), (name, state)
+            assert bits.is_ended(bit_state) == board.is_ended(state), (name, state)
+            if board.is_ended(state):
+                assert bits.points_values(bit_state) == board.points_values(state), (name, state)
+                break
+
+            actions = board.legal_actions(state)
+            assert sorted(bits.legal_actions(bit_state)) == sorted(map(square, actions)), (name, state)
+
+            action = random.choice(actions)
+            next_state = board.next_state(state, action)
+            key = child_key(key, state, action, next_state)
+            bit_state = bits.next_state(bit_state, square(action))
+            state = next_state
+
+    print("%s matches p2_t3.Board over %d games" % (name, games))
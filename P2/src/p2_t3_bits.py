@@ -0,0 +1,131 @@
+""" A compact bitboard version of the Ultimate Tic-Tac-Toe rules in p2_t3, used for rollouts.
+
+A state is the tuple (x, o, meta1, meta2, active, player):
+    x, o:           81-bit masks of the squares taken by player 1 and player 2. Square (R, C, r, c) is
+                    bit 9 * (3 * R + C) + (3 * r + c), so every sub-board occupies 9 consecutive bits.
+    meta1, meta2:   9-bit masks of the sub-boards won by player 1 and player 2. A full sub-board without
+                    a winner is marked in both, just like p2_t3.
+    active:         The sub-board the next action must be played in, or -1 if any open sub-board is allowed.
+    player:         The player to move, 1 or 2.
+
+Actions are square indices in the range 0-80.
+"""
+
+from random import getrandbits
+
+LOCAL_MASK = 0x1ff
+
+# Rows, columns and diagonals of a 3x3 board, using the same bit order as p2_t3.positions
+WIN_MASKS = (0o007, 0o070, 0o700, 0o111, 0o222, 0o444, 0o421, 0o124)
+
+# BOARD_MASKS[b] covers the 9 squares of sub-board b
+BOARD_MASKS = tuple(LOCAL_MASK << (9 * b) for b in range(9))
+
+# OPEN_MASKS[finished] covers the squares of every sub-board not set in the 9-bit mask finished
+OPEN_MASKS = tuple(
+    sum(BOARD_MASKS[b] for b in range(9) if not finished & (1 << b))
+    for finished in range(512)
+)
+
+
+# WIN_LUT[bb] is 1 if the 9-bit board mask bb contains a row, column or diagonal
+WIN_LUT = bytearray(512)
+for bb in range(512):
+    WIN_LUT[bb] = any((bb & m) == m for m in WIN_MASKS)
+del bb
+
+
+def random_legal(bits):
+    """ Picks a uniformly random square from a mask of legal squares without building a list.
+
+    Args:
+        bits:   A non-empty mask of legal squares, e.g. from BitBoard.legal_bits.
+
+    Returns:    The index of the chosen square
+
+    """
+    r = getrandbits(16) % bits.bit_count()
+    for _ in range(r):
+        bits &= bits - 1
+    return (bits & -bits).bit_length() - 1
+
+
+class BitBoard(object):
+
+    def from_state(self, state):
+        """ Translates a p2_t3 state into a bitboard state.
+
+        Args:
+            state:  A state produced by p2_t3.Board.
+
+        Returns:    The equivalent bitboard state.
+
+        """
+        x = o = 0
+        for b in range(9):
+            x |= state[2 * b] << (9 * b)
+            o |= state[2 * b + 1] << (9 * b)
+        active = -1 if state[20] is None else 3 * state[20] + state[21]
+        return (x, o, state[18], state[19], active, state[22])
+
+    def next_state(self, state, action):
+        x, o, meta1, meta2, active, player = state
+        b = action // 9
+        square = 1 << action
+
+        if player == 1:
+            x |= square
+            local = (x >> (9 * b)) & LOCAL_MASK
+            if WIN_LUT[local]:
+                meta1 |= 1 << b
+        else:
+            o |= square
+            local = (o >> (9 * b)) & LOCAL_MASK
+            if WIN_LUT[local]:
+                meta2 |= 1 << b
+
+        if not (meta1 | meta2) & (1 << b) and ((x | o) >> (9 * b)) & LOCAL_MASK == LOCAL_MASK:
+            meta1 |= 1 << b
+            meta2 |= 1 << b
+
+        active = action % 9
+        if (meta1 | meta2) & (1 << active):
+            active = -1
+
+        return (x, o, meta1, meta2, active, 3 - player)
+
+    def legal_bits(self, state):
+        x, o, meta1, meta2, active, _ = state
+        bits = ~(x | o) & OPEN_MASKS[meta1 | meta2]
+        if active >= 0:
+            bits &= BOARD_MASKS[active]
+        return bits
+
+    def legal_actions(self, state):
+        bits = self.legal_bits(state)
+        actions = []
+        while bits:
+            bit = bits & -bits
+            actions.append(bit.bit_length() - 1)
+            bits ^= bit
+        return actions
+
+    def current_player(self, state):
+        return state[5]
+
+    def is_ended(self, state):
+        meta1, meta2 = state[2], state[3]
+        if WIN_LUT[meta1 & ~meta2]:
+            return True
+        if WIN_LUT[meta2 & ~meta1]:
+            return True
+        return meta1 | meta2 == LOCAL_MASK
+
+    def points_values(self, state):
+        meta1, meta2 = state[2], state[3]
+        if WIN_LUT[meta1 & ~meta2]:
+            return {1: 1, 2: -1}
+        if WIN_LUT[meta2 & ~meta1]:
+            return {1: -1, 2: 1}
+        if meta1 | meta2 == LOCAL_MASK:
+            return {1: 0, 2: 0}
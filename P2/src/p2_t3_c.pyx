@@ -0,0 +1,148 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+""" A Cython version of p2_t3_bits.BitBoard, used for rollouts when it has been compiled with
+
+    cythonize -i p2_t3_c.pyx
+
+CBoard has the same methods as BitBoard, but keeps each player's 81 squares in two C 64-bit words so the
+rules run on machine integers. A state is the tuple (x_lo, x_hi, o_lo, o_hi, meta1, meta2, active, player):
+sub-boards 0-6 live in the low word, sub-boards 7 and 8 in the high word. Actions are still square
+indices in the range 0-80, and legal_bits still returns a single 81-bit mask.
+"""
+
+from libc.stdint cimport uint64_t
+
+cdef enum:
+    LOCAL_MASK = 0x1ff
+    LO_BOARDS = 7               # sub-boards stored in the low word
+
+cdef unsigned char WIN[512]
+cdef uint64_t OPEN_LO[512]
+cdef uint64_t OPEN_HI[512]
+
+cdef int _bb, _b
+for _bb in range(512):
+    WIN[_bb] = any((_bb & m) == m for m in (0o007, 0o070, 0o700, 0o111, 0o222, 0o444, 0o421, 0o124))
+    OPEN_LO[_bb] = 0
+    OPEN_HI[_bb] = 0
+    for _b in range(9):
+        if not _bb & (1 << _b):
+            if _b < LO_BOARDS:
+                OPEN_LO[_bb] |= (<uint64_t>LOCAL_MASK) << (9 * _b)
+            else:
+                OPEN_HI[_bb] |= (<uint64_t>LOCAL_MASK) << (9 * (_b - LO_BOARDS))
+
+
+cdef inline unsigned int _local(uint64_t lo, uint64_t hi, int b):
+    # the 9 squares of sub-board b
+    if b < LO_BOARDS:
+        return (lo >> (9 * b)) & LOCAL_MASK
+    return (hi >> (9 * (b - LO_BOARDS))) & LOCAL_MASK
+
+
+cdef class CBoard:
+
+    def from_state(self, state):
+        """ Translates a p2_t3 state into a CBoard state.
+
+        Args:
+            state:  A state produced by p2_t3.Board.
+
+        Returns:    The equivalent CBoard state.
+
+        """
+        cdef uint64_t x_lo = 0, x_hi = 0, o_lo = 0, o_hi = 0
+        cdef int b
+        for b in range(9):
+            if b < LO_BOARDS:
+                x_lo |= (<uint64_t>state[2 * b]) << (9 * b)
+                o_lo |= (<uint64_t>state[2 * b + 1]) << (9 * b)
+            else:
+                x_hi |= (<uint64_t>state[2 * b]) << (9 * (b - LO_BOARDS))
+                o_hi |= (<uint64_t>state[2 * b + 1]) << (9 * (b - LO_BOARDS))
+        active = -1 if state[20] is None else 3 * state[20] + state[21]
+        return (x_lo, x_hi, o_lo, o_hi, state[18], state[19], active, state[22])
+
+    cpdef tuple next_state(self, tuple state, int action):
+        cdef uint64_t x_lo = state[0], x_hi = state[1], o_lo = state[2], o_hi = state[3]
+        cdef unsigned int meta1 = state[4], meta2 = state[5]
+        cdef int player = state[7]
+        cdef int b = action // 9
+        cdef int active = action % 9
+        cdef uint64_t square
+
+        if action < 9 * LO_BOARDS:
+            square = (<uint64_t>1) << action
+            if player == 1:
+                x_lo |= square
+            else:
+                o_lo |= square
+        else:
+            square = (<uint64_t>1) << (action - 9 * LO_BOARDS)
+            if player == 1:
+                x_hi |= square
+            else:
+                o_hi |= square
+
+        if player == 1:
+            if WIN[_local(x_lo, x_hi, b)]:
+                meta1 |= 1 << b
+        elif WIN[_local(o_lo, o_hi, b)]:
+            meta2 |= 1 << b
+
+        if not (meta1 | meta2) & (1 << b) and _local(x_lo | o_lo, x_hi | o_hi, b) == LOCAL_MASK:
+            meta1 |= 1 << b
+            meta2 |= 1 << b
+
+        if (meta1 | meta2) & (1 << active):
+            active = -1
+
+        return (x_lo, x_hi, o_lo, o_hi, meta1, meta2, active, 3 - player)
+
+    cdef void _legal(self, tuple state, uint64_t *lo, uint64_t *hi):
+        # the legal squares, split into the low and high word
+        cdef uint64_t x_lo = state[0], x_hi = state[1], o_lo = state[2], o_hi = state[3]
+        cdef unsigned int finished = <unsigned int>state[4] | <unsigned int>state[5]
+        cdef int active = state[6]
+        lo[0] = ~(x_lo | o_lo) & OPEN_LO[finished]
+        hi[0] = ~(x_hi | o_hi) & OPEN_HI[finished]
+        if active >= 0:
+            if active < LO_BOARDS:
+                lo[0] &= (<uint64_t>LOCAL_MASK) << (9 * active)
+                hi[0] = 0
+            else:
+                lo[0] = 0
+                hi[0] &= (<uint64_t>LOCAL_MASK) << (9 * (active - LO_BOARDS))
+
+    cpdef object legal_bits(self, tuple state):
+        cdef uint64_t lo, hi
+        self._legal(state, &lo, &hi)
+        return (<object>hi << (9 * LO_BOARDS)) | lo
+
+    cpdef list legal_actions(self, tuple state):
+        cdef uint64_t lo, hi
+        cdef int i
+        cdef list actions = []
+        self._legal(state, &lo, &hi)
+        for i in range(9 * LO_BOARDS):
+            if (lo >> i) & 1:
+                actions.append(i)
+        for i in range(9 * (9 - LO_BOARDS)):
+            if (hi >> i) & 1:
+                actions.append(9 * LO_BOARDS + i)
+        return actions
+
+    cpdef int current_player(self, tuple state):
+        return state[7]
+
+    cpdef bint is_ended(self, tuple state):
+        cdef unsigned int meta1 = state[4], meta2 = state[5]
+        return WIN[meta1 & ~meta2 & LOCAL_MASK] or WIN[meta2 & ~meta1 & LOCAL_MASK] or meta1 | meta2 == LOCAL_MASK
+
+    def points_values(self, tuple state):
+        cdef unsigned int meta1 = state[4], meta2 = state[5]
+        if WIN[meta1 & ~meta2 & LOCAL_MASK]:
+            return {1: 1, 2: -1}
+        if WIN[meta2 & ~meta1 & LOCAL_MASK]:
+            return {1: -1, 2: 1}
+        if meta1 | meta2 == LOCAL_MASK:
+            return {1: 0, 2: 0}